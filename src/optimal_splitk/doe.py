@@ -1,15 +1,44 @@
+import os
+import functools
 import numpy as np
 import numba
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from .encode import encode_model, encode_design, decode_design
+from .encode import encode_model, encode_design, decode_design, encoded_col_start
 from .init import initialize_single
 from .optim.doptim import Doptim
-from .utils import CACHE
+from .optimizers import refresh_inverse
+from .utils import np_seed, disk_cache, CACHE
 
 ##################################################################                
 ##  UPDATE FORMULAS
 ##################################################################
 
+# Largest power computed by chained multiplications instead of `**`
+MAX_CHAIN_POW = 4
+
+@numba.njit(cache=CACHE, inline='always')
+def is_chain_pow(p):
+    """
+    Whether a power of the model is a small non-negative integer,
+    computed by chained multiplications. Other powers (negative or
+    non-integer) are computed by `**`.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    p : int or float
+        The power of a factor in a term of the model
+
+    Returns
+    -------
+    chain : bool
+        Whether to compute the power by chained multiplications
+    """
+    return p >= 0 and p <= MAX_CHAIN_POW and p == np.floor(p)
+
 @numba.njit(cache=CACHE)
 def x2fx(Y, model):
     """
@@ -39,18 +68,141 @@ def x2fx(Y, model):
     X : np.array
         The model matrix
     """
+    # Pre-compute the small integer powers of each factor by chained
+    # multiplications, shared between all terms
+    pows = np.ones((model.shape[1], MAX_CHAIN_POW + 1, *Y.shape[:-1]))
+    for j in range(model.shape[1]):
+        max_pow = 0
+        for i in range(model.shape[0]):
+            if is_chain_pow(model[i, j]):
+                max_pow = max(max_pow, int(model[i, j]))
+        for k in range(1, max_pow + 1):
+            pows[j, k] = pows[j, k-1] * Y[..., j]
+
+    # Compute the terms
     X = np.zeros((*Y.shape[:-1], model.shape[0]))
     for i, term in enumerate(model):
         p = np.ones(Y.shape[:-1])
         for j in range(model.shape[1]):
             if term[j] != 0:
-                if term[j] == 1:
-                    p *= Y[..., j]
+                if is_chain_pow(term[j]):
+                    p *= pows[j, int(term[j])]
                 else:
                     p *= Y[..., j] ** term[j]
         X[..., i] = p
     return X
 
+@numba.njit(cache=CACHE, inline='always')
+def x2fx_into(Y, model, out, scratch_p):
+    """
+    Same function as :py:func:`x2fx`, except it writes the model matrix
+    into preallocated arrays and does not allocate any memory.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    Y : np.array(2d)
+        The design matrix.
+    model : np.array(2d)
+        The model, specified as in MATLAB.
+    out : np.array(2d)
+        The preallocated model matrix, of shape (Y.shape[0], model.shape[0])
+    scratch_p : np.array(1d)
+        A preallocated buffer of size Y.shape[0]
+
+    Returns
+    -------
+    out : np.array(2d)
+        The model matrix
+    """
+    out[:] = 0
+    for i in range(model.shape[0]):
+        scratch_p[:] = 1
+        for j in range(model.shape[1]):
+            if is_chain_pow(model[i, j]):
+                # Small integer powers as multiplications
+                for _ in range(int(model[i, j])):
+                    scratch_p *= Y[:, j]
+            else:
+                for r in range(Y.shape[0]):
+                    scratch_p[r] *= Y[r, j] ** model[i, j]
+        out[:, i] = scratch_p
+    return out
+
+@numba.njit(cache=CACHE, inline='always')
+def update_model_cols(X, Y, model, terms):
+    """
+    Recompute only the specified terms (columns) of the model matrix
+    after a change in the design matrix. See :py:func:`x2fx` for the
+    specification of the model.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    X : np.array(2d)
+        The model matrix to update in-place
+    Y : np.array(2d)
+        The design matrix corresponding to the rows of X
+    model : np.array(2d)
+        The model, specified as in MATLAB.
+    terms : np.array(1d)
+        The indices of the terms to recompute
+
+    Returns
+    -------
+    X : np.array(2d)
+        The updated model matrix
+    """
+    for t in terms:
+        for r in range(Y.shape[0]):
+            p = 1.0
+            for j in range(model.shape[1]):
+                if is_chain_pow(model[t, j]):
+                    # Small integer powers as multiplications
+                    for _ in range(int(model[t, j])):
+                        p *= Y[r, j]
+                else:
+                    p *= Y[r, j] ** model[t, j]
+            X[r, t] = p
+    return X
+
+@numba.njit(cache=CACHE, inline='always')
+def vanishes_at_zero(model, fterms, col, cat_lvl):
+    """
+    Whether all terms of a factor vanish when it is set to zero, i.e.,
+    the factor is continuous and only has positive powers (zero to a
+    negative power is not zero).
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    model : np.array(2d)
+        The encoded model, specified as in MATLAB.
+    fterms : np.array(1d)
+        The indices of the terms of the factor
+    col : int
+        The column of the factor in the design matrix
+    cat_lvl : int
+        The type of the factor (continuous = 1, categorical > 1)
+
+    Returns
+    -------
+    vanishes : bool
+        Whether all terms of the factor vanish at zero
+    """
+    if cat_lvl > 1:
+        return False
+    for t in fterms:
+        if model[t, col] <= 0:
+            return False
+    return True
+
 ##################################################################
 ##  OPTIMIZATION
 ##################################################################
@@ -96,15 +248,479 @@ def generate_coordinates(cat_lvl, default=np.array([[]], dtype=np.float64)):
 
     return possible_coords
 
-# not compilable with numba v0.59.0
-#@numba.njit(cache=CACHE)
+@functools.lru_cache(maxsize=32)
+def __cached_coordinates(cat_lvl):
+    """
+    Memoized version of :py:func:`generate_coordinates` without
+    default coordinates. The returned array is read-only as it is
+    shared between all calls.
+
+    .. note::
+        See :py:func:`generate_coordinates` for more information
+
+    """
+    possible_coords = generate_coordinates(cat_lvl)
+    possible_coords.flags.writeable = False
+    return possible_coords
+
+def pack_coordinates(cat_lvls, default_coords=None):
+    """
+    Generate the possible coordinates of all factors and pack them
+    in a single 2D array, as Numba cannot index a list of arrays with
+    different shapes. The coordinates of factor i are stored in
+    the rows `offsets[i]` to `offsets[i+1]`, with the columns padded
+    up to the widest factor.
+
+    Parameters
+    ----------
+    cat_lvls : np.array(1d)
+        The type of each factor (continuous = 1, categorical > 1).
+    default_coords : list(np.array(2d))
+        Contains possible default coordinates for all the different
+        factors. If None, a default set will be generated by 
+        :py:func:`generate_coordinates` 
+
+    Returns
+    -------
+    coords : np.array(2d)
+        The possible coordinates of all factors
+    offsets : np.array(1d)
+        The first row of each factor in coords, with an additional
+        last element being the total amount of rows.
+    """
+    # Compute possible coordinates for each level
+    if default_coords is None:
+        default_coords = [None] * len(cat_lvls)
+    _possible_coords = [dcoord if dcoord is not None and dcoord.size > 0 else __cached_coordinates(int(cat_lvl)) 
+                        for dcoord, cat_lvl in zip(default_coords, cat_lvls)]
+
+    # Compute the offsets
+    offsets = np.zeros(len(_possible_coords) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([c.shape[0] for c in _possible_coords])
+
+    # Pack all coordinates
+    coords = np.zeros((offsets[-1], max(c.shape[1] for c in _possible_coords)), dtype=np.float64)
+    for i, c in enumerate(_possible_coords):
+        coords[offsets[i]:offsets[i+1], :c.shape[1]] = c
+
+    return coords, offsets
+
+def affected_terms(model, col_start):
+    """
+    Compute the terms of the model which depend on each factor, i.e.,
+    the columns of the model matrix which change when the factor
+    is adjusted. The terms of factor i are stored at the indices 
+    `offsets[i]` to `offsets[i+1]`.
+
+    Parameters
+    ----------
+    model : np.array(2d)
+        The encoded model, specified as in MATLAB.
+    col_start : np.array(1d)
+        Contains the starting column of each effect.
+
+    Returns
+    -------
+    terms : np.array(1d)
+        The indices of the terms of all factors
+    offsets : np.array(1d)
+        The first index of each factor in terms, with an additional
+        last element being the total amount of indices.
+    """
+    # Find the terms per factor
+    _terms = [np.nonzero(np.any(model[:, col_start[i]:col_start[i+1]] != 0, axis=1))[0] 
+              for i in range(col_start.size - 1)]
+
+    # Compute the offsets
+    offsets = np.zeros(len(_terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([t.size for t in _terms])
+
+    # Pack the terms
+    terms = np.concatenate(_terms).astype(np.int64)
+
+    return terms, offsets
+
+def specialize_model_cols(model, col_start):
+    """
+    Generate a specialized version of :py:func:`update_model_cols` for
+    a specific model. The generated function `update_cols(X, Y, factor)`
+    recomputes the terms affected by the factor, with each term unrolled
+    as a product of the columns of the design matrix, e.g.,
+    `X[r, 3] = Y[r, 1] * Y[r, 2] * Y[r, 2]`.
+    The functions are memoized per model.
+
+    .. note::
+        The generated function is Numba accelerated. As each
+        function has its own type, the coordinate exchange iterations
+        are compiled once more for each model.
+
+    Parameters
+    ----------
+    model : np.array(2d)
+        The encoded model, specified as in MATLAB.
+    col_start : np.array(1d)
+        Contains the starting column of each effect.
+
+    Returns
+    -------
+    update_cols : function(np.array(2d), np.array(2d), int)
+        The Numba compiled function updating the model matrix (first
+        argument) in-place from the design matrix (second argument)
+        for the given factor.
+    """
+    model = np.ascontiguousarray(model, dtype=np.float64)
+    col_start = np.ascontiguousarray(col_start, dtype=np.int64)
+    return __specialized_model_cols(model.shape, model.tobytes(), col_start.tobytes())
+
+def __chain_pow_src(j, p):
+    """
+    Generate the source of a power of column j of the design matrix,
+    as chained multiplications if possible (see :py:func:`is_chain_pow`).
+
+    .. note::
+        See :py:func:`specialize_model_cols` for more information
+
+    """
+    if is_chain_pow(p):
+        return ' * '.join([f'Y[r, {j}]'] * int(p))
+    return f'Y[r, {j}] ** {float(p)!r}'
+
+@functools.lru_cache(maxsize=8)
+def __specialized_model_cols(shape, model_bytes, col_start_bytes):
+    """
+    Memoized implementation of :py:func:`specialize_model_cols`, the
+    arrays are passed as bytes to be hashable.
+
+    .. note::
+        See :py:func:`specialize_model_cols` for more information
+
+    """
+    model = np.frombuffer(model_bytes, dtype=np.float64).reshape(shape)
+    col_start = np.frombuffer(col_start_bytes, dtype=np.int64)
+    terms, offsets = affected_terms(model, col_start)
+
+    # Generate the source
+    src = ['def update_cols(X, Y, factor):']
+    for i in range(col_start.size - 1):
+        # Factors without terms do not change the model matrix
+        if offsets[i] == offsets[i+1]:
+            continue
+        src.append(f'    {"if" if len(src) == 1 else "elif"} factor == {i}:')
+        src.append('        for r in range(X.shape[0]):')
+        for t in terms[offsets[i]:offsets[i+1]]:
+            p = ' * '.join(__chain_pow_src(j, model[t, j]) for j in range(model.shape[1]) if model[t, j] != 0)
+            src.append(f'            X[r, {t}] = {p}')
+    src.append('    return X')
+
+    # Compile the function
+    namespace = dict()
+    exec('\n'.join(src), namespace)
+    return numba.njit(nogil=True)(namespace['update_cols'])
+
+@numba.njit(cache=CACHE, nogil=True)
+def __optimize_numba(Y, X, model, alphas, betas, levels, cat_lvls, col_start, 
+                     coords, coords_offsets, terms, terms_offsets, update, state, max_it,
+                     update_cols=None, update_batched=None):
+    """
+    Nopython implementation of the coordinate exchange iterations. The
+    update function of the optimization criterion is passed as an argument
+    and is specialized by Numba. The GIL is released to allow multiple
+    random starts in parallel threads. If the batched update function is
+    provided, all candidates of a run-group are evaluated at once for factors
+    with more than two candidates (below, the shared computations do not 
+    compensate the overhead of the batch).
+
+    .. note::
+        See :py:func:`optimize` for more information
+
+    .. note::
+        This function is Numba accelerated
+
+    """
+    # Preallocate the buffers of the run-groups
+    Xi_buf = np.empty((np.max(betas[levels]), X.shape[1]), dtype=X.dtype)
+    coord_buf = np.empty(coords.shape[1])
+
+    # Preallocate the buffers of the batched candidates
+    n_batch = np.max(np.diff(coords_offsets)) if update_batched is not None else 0
+    Xi_batch_buf = np.empty(n_batch * Xi_buf.size, dtype=X.dtype)
+    candidates = np.empty(n_batch, dtype=np.int64)
+
+    # Updates and iterations since the last recomputation of the inverse
+    n_updates, n_stale = 0, 0
+
+    # Make sure we are not stuck in finite loop
+    for it in range(max_it):
+        # Start with updated false
+        updated = False
+
+        ##################################################
+        # FACTOR SELECTION
+        ##################################################
+
+        # Loop over all factors
+        for i in range(levels.size):
+            # Level in split-plot
+            level = levels[i]
+            jmp = betas[level]
+            col = col_start[i]
+            ncols = col_start[i+1] - col
+            fterms = terms[terms_offsets[i]:terms_offsets[i+1]]
+            vanishes = vanishes_at_zero(model, fterms, col, cat_lvls[i])
+
+            # Loop over all run-groups
+            for grp in range(alphas[level]):
+
+                ##################################################
+                # COORDINATE GENERATION
+                ##################################################
+                # Generate coordinates
+                start, end = grp*jmp, (grp+1)*jmp
+
+                # Extract current coordinate (as best)
+                init_coord = coord_buf[:ncols]
+                init_coord[:] = Y[start, col:col+ncols]
+                best = -1
+
+                # Only the terms of this factor change
+                Xi_star = Xi_buf[:jmp]
+                Xi_star[:] = X[start:end]
+
+                # Find the current coordinate in the possible coordinates
+                skip = -1
+                for k in range(coords_offsets[i], coords_offsets[i+1]):
+                    if np.all(coords[k, :ncols] == init_coord):
+                        skip = k
+                        break
+
+                # Contiguous rows of each candidate (if batched)
+                n_cand = coords_offsets[i+1] - coords_offsets[i] - (skip >= 0)
+                batch = update_batched is not None and n_cand > 2
+                n_cand = n_cand if batch else 0
+                Xi_batch = Xi_batch_buf[:n_cand*Xi_star.size].reshape((n_cand, jmp, X.shape[1]))
+
+                # Loop over possible new coordinates
+                n = 0
+                for k in range(coords_offsets[i], coords_offsets[i+1]):
+                    # Validate whether to check the coordinate
+                    if k == skip:
+                        continue
+
+                    # Set new coordinate
+                    new_coord = coords[k, :ncols]
+                    Y[start:end, col:col+ncols] = new_coord
+
+                    # Each candidate has its own rows in a batch
+                    if batch:
+                        Xi_star = Xi_batch[n]
+                        Xi_star[:] = X[start:end]
+
+                    ##################################################
+                    # COMPUTE UPDATE
+                    ##################################################
+                    # Compute the model matrix of the update
+                    if vanishes and new_coord[0] == 0:
+                        # Continuous factor at zero: all terms vanish
+                        for t in fterms:
+                            Xi_star[:, t] = 0
+                    elif update_cols is not None:
+                        update_cols(Xi_star, Y[start:end], i)
+                    else:
+                        update_model_cols(Xi_star, Y[start:end], model, fterms)
+
+                    # Evaluate the batch after the loop
+                    if batch:
+                        candidates[n] = k
+                        n += 1
+                        continue
+
+                    # Compute the update (singularity is signaled 
+                    # by returning no update)
+                    accept, state = update(state, X, Xi_star, level, grp)
+                    
+                    ##################################################
+                    # ACCEPT UPDATE
+                    ##################################################
+                    # New best design
+                    if accept:
+                        # Store the best coordinates
+                        best = k
+                        # Update X (model matrix)
+                        X[start:end] = Xi_star
+                        # Set update
+                        updated = True
+                        n_updates += 1
+
+                # Evaluate all candidates at once and apply the best
+                if update_batched is not None:
+                    if batch:
+                        b, state = update_batched(state, X, Xi_batch, level, grp)
+                        if b >= 0:
+                            best = candidates[b]
+                            X[start:end] = Xi_batch[b]
+                            updated = True
+                            n_updates += 1
+                
+                # Set the best coordinates
+                if best >= 0:
+                    Y[start:end, col:col+ncols] = coords[best, :ncols]
+                else:
+                    Y[start:end, col:col+ncols] = init_coord
+        
+        # Stop if nothing updated for an entire iteration
+        if not updated:
+            break
+        elif refresh_inverse(X, state, n_updates, n_stale):
+            n_updates, n_stale = 0, 0
+        else:
+            n_stale += 1
+
+    return Y
+
+@numba.njit(cache=CACHE)
+def __best_coordinate(Y, X, model, i, level, grp, start, end, col, ncols, vanishes,
+                      coords, fterms, score, state, update_cols=None):
+    """
+    Evaluate all possible coordinates of a single run-group without
+    modifying the design.
+
+    .. note::
+        See :py:func:`__optimize_numba_parallel` for more information
+
+    .. note::
+        This function is Numba accelerated
+
+    """
+    # Private copies of the group
+    Yi = Y[start:end].copy()
+    Xi_star = X[start:end].copy()
+    best = -1
+    best_value = -np.inf
+
+    # Loop over possible new coordinates
+    for k in range(coords.shape[0]):
+        # Skip the current coordinate
+        new_coord = coords[k, :ncols]
+        if np.all(new_coord == Y[start, col:col+ncols]):
+            continue
+
+        # Compute the model matrix of the update
+        Yi[:, col:col+ncols] = new_coord
+        if vanishes and new_coord[0] == 0:
+            for t in fterms:
+                Xi_star[:, t] = 0
+        elif update_cols is not None:
+            update_cols(Xi_star, Yi, i)
+        else:
+            update_model_cols(Xi_star, Yi, model, fterms)
+
+        # Evaluate the update
+        accept, value = score(state, X, Xi_star, level, grp)
+        if accept and value > best_value:
+            best = k
+            best_value = value
+
+    return best
+
+@numba.njit(cache=CACHE, parallel=True)
+def __optimize_numba_parallel(Y, X, model, alphas, betas, levels, cat_lvls, col_start, 
+                              coords, coords_offsets, terms, terms_offsets, score, update, state, max_it,
+                              update_cols=None):
+    """
+    Parallel implementation of the coordinate exchange iterations. For each
+    factor, the run-groups are evaluated in parallel against the current
+    design (phase 1), after which the best coordinate of each group is
+    applied in order of the groups if it still improves the
+    design (phase 2).
+
+    .. note::
+        See :py:func:`optimize` for more information
+
+    .. note::
+        This function is Numba accelerated
+
+    """
+    # Preallocate the best coordinate of each group
+    best = np.empty(np.max(alphas[levels]), dtype=np.int64)
+    Xi_buf = np.empty((np.max(betas[levels]), X.shape[1]), dtype=X.dtype)
+
+    # Updates and iterations since the last recomputation of the inverse
+    n_updates, n_stale = 0, 0
+
+    # Make sure we are not stuck in finite loop
+    for it in range(max_it):
+        # Start with updated false
+        updated = False
+
+        # Loop over all factors
+        for i in range(levels.size):
+            # Level in split-plot
+            level = levels[i]
+            jmp = betas[level]
+            col = col_start[i]
+            ncols = col_start[i+1] - col
+            fterms = terms[terms_offsets[i]:terms_offsets[i+1]]
+            vanishes = vanishes_at_zero(model, fterms, col, cat_lvls[i])
+
+            ##################################################
+            # PHASE 1: EVALUATE THE GROUPS
+            ##################################################
+            fcoords = coords[coords_offsets[i]:coords_offsets[i+1]]
+            for grp in numba.prange(alphas[level]):
+                best[grp] = __best_coordinate(Y, X, model, i, level, grp, grp*jmp, (grp+1)*jmp, 
+                                              col, ncols, vanishes, fcoords, fterms, score, state,
+                                              update_cols)
+
+            ##################################################
+            # PHASE 2: APPLY THE UPDATES
+            ##################################################
+            for grp in range(alphas[level]):
+                if best[grp] < 0:
+                    continue
+                start, end = grp*jmp, (grp+1)*jmp
+
+                # Set the new coordinate
+                init_coord = Y[start, col:col+ncols].copy()
+                Y[start:end, col:col+ncols] = fcoords[best[grp], :ncols]
+
+                # Compute the model matrix of the update
+                Xi_star = Xi_buf[:jmp]
+                Xi_star[:] = X[start:end]
+                if update_cols is not None:
+                    update_cols(Xi_star, Y[start:end], i)
+                else:
+                    update_model_cols(Xi_star, Y[start:end], model, fterms)
+
+                # Validate against the updated design (the state is updated
+                # in-place, it may not be reassigned in a parallel function)
+                accept, _ = update(state, X, Xi_star, level, grp)
+                if accept:
+                    X[start:end] = Xi_star
+                    updated = True
+                    n_updates += 1
+                else:
+                    Y[start:end, col:col+ncols] = init_coord
+        
+        # Stop if nothing updated for an entire iteration
+        if not updated:
+            break
+        elif refresh_inverse(X, state, n_updates, n_stale):
+            n_updates, n_stale = 0, 0
+        else:
+            n_stale += 1
+
+    return Y
+
 def optimize(Y, model, plot_sizes, factors,
-             optim:object, prestate, max_it=10, col_start=None, default_coords=None):
+             optim:object, prestate, max_it=10, col_start=None, default_coords=None,
+             levels=None, cat_lvls=None, coords=None, terms=None, dtype=np.float64,
+             parallel=False, update_cols=None):
     """
     Optimize a model iteratively using the coordinate exchange algorithm.
 
     .. note::
-        This function is Numba accelerated
+        The iterations are Numba accelerated, the functions of the
+        optimization object must therefore be Numba compiled.
 
     Parameters
     ----------
@@ -125,7 +741,8 @@ def optimize(Y, model, plot_sizes, factors,
         to an optimization criterion (like D-optimality by default)
     prestate : `Prestate`
         The pre-computed state return from the optim.prestate function. This allows
-        some caching related to the specific metric.
+        some caching related to the specific metric. It must contain the alphas
+        and betas of the plot sizes.
     max_it : int
         The maximum amount of iterations for the algorithm, if at one iteration,
         no update is performed, the algorithm is ended earlier.
@@ -137,6 +754,33 @@ def optimize(Y, model, plot_sizes, factors,
         Contains possible default coordinates for all the different
         factors. If None, a default set will be generated by 
         :py:func:`generate_coordinates` 
+    levels : np.array(1d)
+        Possibly pre-computed split-plot-level of each factor, 
+        as a contiguous array (the first column of factors).
+    cat_lvls : np.array(1d)
+        Possibly pre-computed type of each factor, as a
+        contiguous array (the second column of factors).
+    coords : tuple(np.array(2d), np.array(1d))
+        Possibly pre-computed possible coordinates and their offsets,
+        as returned by :py:func:`pack_coordinates`.
+    terms : tuple(np.array(1d), np.array(1d))
+        Possibly pre-computed terms of each factor and their offsets,
+        as returned by :py:func:`affected_terms`.
+    dtype : np.dtype
+        The floating point type of the model matrix and the state during
+        the iterations. Single precision (np.float32) halves the memory
+        traffic of the updates, but is only used for models with at least
+        64 terms. The final metric is always computed in double precision.
+    parallel : bool
+        Whether to evaluate the run-groups of a factor in parallel (Numba threads).
+        The best coordinate of each group is selected against the same design, 
+        and the selections are applied afterwards, instead of greedily one group 
+        after another. Only used if the optimization object has a score function,
+        otherwise the groups are evaluated serially.
+    update_cols : function
+        The function updating the model matrix for a factor, as generated
+        by :py:func:`specialize_model_cols`, or None to use the generic
+        :py:func:`update_model_cols`.
 
     Returns
     -------
@@ -148,102 +792,65 @@ def optimize(Y, model, plot_sizes, factors,
     ##################################################
     # INITIALIZATION
     ##################################################
+    # Single precision only pays off for large model matrices
+    if model.shape[0] < 64:
+        dtype = np.float64
+    prestate64 = prestate
+    if dtype != np.float64:
+        prestate = type(prestate)(*(
+            a.astype(dtype, copy=False) if isinstance(a, np.ndarray) and a.dtype == np.float64 else a
+            for a in prestate
+        ))
+
+    # The powers may be negative or non-integer
+    model = np.ascontiguousarray(model, dtype=np.float64)
+
     # Compute model matrix
-    X = x2fx(Y, model)
+    X = x2fx_into(Y, model, np.empty((Y.shape[0], model.shape[0]), dtype=dtype), 
+                  np.empty(Y.shape[0], dtype=dtype))
 
     # State initialization
     state = optim.init(prestate, Y, X)
 
-    # Compute betas
-    alphas = np.cumprod(plot_sizes[::-1])[::-1]
-    betas = np.cumprod(np.concatenate((np.array([1]), plot_sizes)))
+    # Pre-computed alphas and betas
+    alphas, betas = prestate.alphas, prestate.betas
+
+    # Split the factors in contiguous arrays
+    if levels is None:
+        levels = np.ascontiguousarray(factors[:, 0], dtype=np.int64)
+    if cat_lvls is None:
+        cat_lvls = np.ascontiguousarray(factors[:, 1], dtype=np.int64)
 
     # Start column of each factor
     if col_start is None:
-        col_start = np.concatenate((np.array([0]), 
-                                    np.cumsum(np.where(factors[:, 1] > 1, 
-                                                       factors[:, 1] - 1, 
-                                                       np.ones(factors.shape[0], dtype=np.int64)))))
+        col_start = encoded_col_start(cat_lvls)
 
     # Compute possible coordinates for each level
-    if default_coords is not None:
-        _possible_coords = [generate_coordinates(cat_lvl, dcoord) for dcoord, (_, cat_lvl) in zip(default_coords, factors)]
-    else:
-        _possible_coords = [generate_coordinates(cat_lvl) for _, cat_lvl in factors]
-
-    # Make sure we are not stuck in finite loop
-    for it in range(max_it):
-        # Start with updated false
-        updated = False
-
-        ##################################################
-        # FACTOR SELECTION
-        ##################################################
-
-        # Loop over all factors
-        for i, factor in enumerate(factors):
-            # Level in split-plot
-            level, cat_lvl = factor[0], factor[1]
-            jmp = betas[level]
-            col = col_start[i]
+    if coords is None:
+        coords = pack_coordinates(cat_lvls, default_coords)
+    coords, coords_offsets = coords
 
-            # Loop over all run-groups
-            for grp in range(alphas[level]):
-
-                ##################################################
-                # COORDINATE GENERATION
-                ##################################################
-                # Generate coordinates
-                possible_coords = _possible_coords[i]
-                cols = slice(col, col + possible_coords.shape[1])
-                runs = slice(grp*jmp, (grp+1)*jmp)
-
-                # Extract current coordinate (as best)
-                init_coord = np.copy(Y[runs.start, cols])
-                best_coord = init_coord
-
-                # Loop over possible new coordinates
-                for new_coord in possible_coords:
-                    # Set new coordinate
-                    Y[runs, cols] = new_coord
+    # Compute the terms affected by each factor
+    if terms is None:
+        terms = affected_terms(model, col_start)
+    terms, terms_offsets = terms
 
-                    # Validate whether to check the coordinate
-                    if not np.all(new_coord == init_coord):
-                        ##################################################
-                        # COMPUTE UPDATE
-                        ##################################################
-                        # Compute the model matrix of the update
-                        Xi_star = x2fx(Y[runs], model)
-
-                        # Protection against singularity errors
-                        try:
-                            # Compute the update
-                            accept, state = optim.update(state, X, Xi_star, level, grp)
-                        except Exception:
-                            accept = False
-                        
-                        ##################################################
-                        # ACCEPT UPDATE
-                        ##################################################
-                        # New best design
-                        if accept:
-                            # Store the best coordinates
-                            best_coord = new_coord
-                            # Update X (model matrix)
-                            X[runs] = Xi_star
-                            # Set update
-                            updated = True
-                
-                # Set the best coordinates
-                Y[runs, cols] = best_coord
-        
-        # Stop if nothing updated for an entire iteration
-        if not updated:
-            break
-        else:
-            state.Minv[:] = np.linalg.inv(X.T @ np.linalg.solve(state.V, X))
+    ##################################################
+    # OPTIMIZATION
+    ##################################################
+    if parallel and optim.score is not None:
+        Y = __optimize_numba_parallel(Y, X, model, alphas, betas, levels, cat_lvls, col_start, 
+                                      coords, coords_offsets, terms, terms_offsets, 
+                                      optim.score, optim.update, state, max_it, update_cols)
+    else:
+        Y = __optimize_numba(Y, X, model, alphas, betas, levels, cat_lvls, col_start, 
+                             coords, coords_offsets, terms, terms_offsets, 
+                             optim.update, state, max_it, update_cols, optim.update_batched)
 
-    # Compute the metric
+    # Compute the metric (in double precision)
+    if X.dtype != np.float64:
+        X = X.astype(np.float64)
+        state = optim.init(prestate64, Y, X)
     metric = optim.metric(state, Y, X)
 
     return Y, metric
@@ -252,12 +859,21 @@ def optimize(Y, model, plot_sizes, factors,
 ##  DOE WRAPPER
 ##################################################################
 
+@disk_cache(ignore=('it_callback', 'n_jobs', 'cache'), required=('seed',), enabled='cache')
 def doe(model, plot_sizes, factors, n_tries=10, max_it=10000, 
-        it_callback=None, optim=Doptim, default_coords=None, ratios=None):
+        it_callback=None, optim=Doptim, default_coords=None, ratios=None,
+        n_jobs=1, seed=None, dtype=np.float64, parallel=False, specialize=False,
+        cache=True):
     """
     Create a D-optimal design of experiments (DOE) using the coordinate exchange algorithm.
     This is the core function of the library.
 
+    .. note::
+        When a seed is provided, the result is cached on disk (see
+        :py:func:`optimal_splitk.utils.disk_cache`), and returned immediately
+        for the same arguments and source code of the package. The cache is 
+        disabled by `cache=False` and removed by `doe.clear()`.
+
     Parameters
     ----------
     model : np.array    
@@ -290,6 +906,27 @@ def doe(model, plot_sizes, factors, n_tries=10, max_it=10000,
         The ratios for each split-level. The size should be the same as
         or 1 less than the amount of plot sizes. If the same, the first
         element should be 1 (to indicate a 1 ratio for epsilon).
+    n_jobs : int
+        The amount of random starts to optimize in parallel threads. 
+        -1 uses all processors. Each thread also uses the BLAS threads,
+        limit these (e.g. by OMP_NUM_THREADS=1) to avoid oversubscription.
+    seed : int
+        The seed from which the seeds of all random starts are generated.
+        If None, they are generated from the global NumPy random state.
+        The result does not depend on n_jobs.
+    dtype : np.dtype
+        The floating point type during the optimization, see :py:func:`optimize`.
+    parallel : bool
+        Whether to evaluate the run-groups in parallel, see :py:func:`optimize`. 
+        The random starts are then optimized one after another, and n_jobs sets 
+        the amount of Numba threads instead. Without a score function of the 
+        optimization object, this has no effect.
+    specialize : bool
+        Whether to generate a function updating the model matrix specialized
+        for the model, see :py:func:`specialize_model_cols`. This is only
+        faster if the additional compilation is amortized by many random starts.
+    cache : bool
+        Whether to cache the result on disk when a seed is provided.
 
     Returns
     -------
@@ -302,7 +939,7 @@ def doe(model, plot_sizes, factors, n_tries=10, max_it=10000,
     # INITIALIZATION
     ##################################################
     # Encode the model
-    model_enc = encode_model(model, factors)
+    model_enc = np.ascontiguousarray(encode_model(model, factors), dtype=np.float64)
 
     # Create empty design
     Y = np.zeros((np.prod(plot_sizes), factors.shape[0]))
@@ -328,36 +965,87 @@ def doe(model, plot_sizes, factors, n_tries=10, max_it=10000,
     # Compute pre-state
     prestate = optim.preinit(plot_sizes, (model, model_enc), factors, ratios)
 
-    # Try multiple random starts
-    with tqdm(total=n_tries) as pbar:
-        i = 0
-        while i < n_tries:
-            ##################################################
-            # DESIGN CREATION
-            ##################################################
-            # Initialize random design and encode it
-            Yo = initialize_single(plot_sizes, factors, Y, coords=default_coords)
-            Yoenc = encode_design(Yo, factors)
+    # Split the factors in contiguous arrays
+    levels = np.ascontiguousarray(factors[:, 0], dtype=np.int64)
+    cat_lvls = np.ascontiguousarray(factors[:, 1], dtype=np.int64)
 
-            ##################################################
-            # OPTIMIZATION
-            ##################################################
-            try:
-                Yo, metric = optimize(Yoenc, model_enc, plot_sizes, factors, 
-                                    optim, prestate, max_it=max_it, default_coords=default_coords)
-
-                # Store the results
-                metrics[i] = metric
-                if metric > best_metric:
-                    best_metric = metric
-                    best_Y = np.copy(Yo)
-
-                # Update the progress
-                i += 1
-                pbar.update(1)
-                it_callback(i)
-            except np.linalg.LinAlgError:
-                pass
+    # Start column of each factor
+    col_start = encoded_col_start(cat_lvls)
+
+    # Compute possible coordinates for each level
+    coords = pack_coordinates(cat_lvls, default_coords)
+
+    # Compute the terms affected by each factor
+    terms = affected_terms(model_enc, col_start)
+
+    # Specialize the update of the model matrix
+    update_cols = specialize_model_cols(model_enc, col_start) if specialize else None
+
+    # Generators of the seeds of each random start
+    rng = np.random.RandomState(seed) if seed is not None else np.random
+
+    # Number of parallel threads
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    parallel = parallel and optim.score is not None
+    num_threads = numba.get_num_threads()
+    if parallel:
+        numba.set_num_threads(min(n_jobs, numba.config.NUMBA_NUM_THREADS))
+        n_jobs = 1
+
+    def single_try(try_seed):
+        ##################################################
+        # DESIGN CREATION
+        ##################################################
+        # Initialize random design and encode it
+        np_seed(try_seed)
+        Yo = initialize_single(plot_sizes, factors, np.zeros_like(Y), coords=default_coords)
+        Yoenc = encode_design(Yo, factors)
+
+        ##################################################
+        # OPTIMIZATION
+        ##################################################
+        try:
+            return optimize(Yoenc, model_enc, plot_sizes, factors, 
+                            optim, prestate, max_it=max_it, col_start=col_start, 
+                            default_coords=default_coords, levels=levels, cat_lvls=cat_lvls,
+                            coords=coords, terms=terms, dtype=dtype, parallel=parallel,
+                            update_cols=update_cols)
+        except np.linalg.LinAlgError:
+            return None
+
+    # Try multiple random starts (and restore the Numba threads afterwards)
+    try:
+        with tqdm(total=n_tries) as pbar, ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            i = 0
+            while i < n_tries:
+                # Generate the seeds of the remaining random starts
+                seeds = rng.randint(0, 2**31 - 1, size=n_tries - i)
+
+                # Optimize (results are in order of the seeds)
+                if n_jobs == 1:
+                    results = map(single_try, seeds)
+                else:
+                    results = executor.map(single_try, seeds)
+
+                for result in results:
+                    # Singular initial design, retry
+                    if result is None:
+                        continue
+
+                    # Store the results
+                    Yo, metric = result
+                    metrics[i] = metric
+                    if metric > best_metric:
+                        best_metric = metric
+                        best_Y = np.copy(Yo)
+
+                    # Update the progress
+                    i += 1
+                    pbar.update(1)
+                    it_callback(i)
+    finally:
+        numba.set_num_threads(num_threads)
 
     # Decode the optimal design
     best_Y = decode_design(best_Y, factors)     
@@ -114,6 +114,29 @@ def encode_design(Y, factors):
 
     return Yenc
 
+def encoded_col_start(cat_lvls):
+    """
+    Compute the starting column of each factor in the encoded design
+    matrix. Continuous factors take one column, categorical factors
+    one column less than their amount of levels.
+
+    Parameters
+    ----------
+    cat_lvls : np.array(1d)
+        The type of each factor (continuous = 1, categorical > 1),
+        i.e., the second column of the factors.
+
+    Returns
+    -------
+    col_start : np.array(1d)
+        The starting column of each factor, with an additional last
+        element being the total amount of columns.
+    """
+    col_start = np.empty(len(cat_lvls) + 1, dtype=np.int64)
+    col_start[0] = 0
+    np.cumsum(np.maximum(cat_lvls - 1, 1), out=col_start[1:])
+    return col_start
+
 @numba.njit(cache=CACHE)
 def decode_design(Y, factors):
     """
@@ -1,6 +1,6 @@
 import numpy as np
 import numba
-from .utils import np_argmax1, CACHE
+from .utils import np_argmax1, alphas_betas, CACHE
 
 @numba.njit(cache=CACHE)
 def __init_unconstrained(factors, Y, alphas, betas, coords=None):
@@ -103,8 +103,7 @@ def initialize_single(plot_sizes, factors, Y=None, coords=None):
         Y = np.zeros((n, ncol), dtype=np.float64)
 
     # Compute alphas and betas
-    alphas = np.cumprod(plot_sizes[::-1])[::-1]
-    betas = np.cumprod(np.concatenate((np.array([1]), plot_sizes)))
+    alphas, betas = alphas_betas(plot_sizes)
 
     ##################################################
     # LOW-LEVEL FUNCTION
@@ -1,5 +1,5 @@
-from ..optimizers import compute_update, det_update, inv_update, Optim
-from ..utils import obs_var, CACHE
+from ..optimizers import info_matrix, update_size, compute_update, lu_det, det_update, inv_update, Optim
+from ..utils import obs_var, alphas_betas, np_inv_spd, np_lu_solve, CACHE
 from collections import namedtuple
 import numba
 import numpy as np
@@ -8,7 +8,7 @@ import numpy as np
 DoptimPreState = namedtuple('DoptimPreState', 'plot_sizes alphas betas betas_inv c V')
 
 # The state of the optimizer
-DoptimState = namedtuple('DoptimState', 'plot_sizes alphas betas betas_inv c V Minv')
+DoptimState = namedtuple('DoptimState', 'plot_sizes alphas betas betas_inv c V Minv U D MinvU P')
 
 @numba.njit(cache=CACHE)
 def preinit(plot_sizes, model, factors, ratios):
@@ -35,8 +35,7 @@ def preinit(plot_sizes, model, factors, ratios):
         The pre state
     """
     # Alphas and betas
-    alphas = np.cumprod(plot_sizes[::-1])[::-1]
-    betas = np.cumprod(np.concatenate((np.array([1]), plot_sizes)))
+    alphas, betas = alphas_betas(plot_sizes)
 
     # Betas inverse
     betas_inv = np.cumsum(np.concatenate((np.array([0], dtype=np.float64), 1/betas[1:])))
@@ -75,12 +74,21 @@ def init(prestate, Y, X):
         Return a state object
     """   
     # Compute information matrix
-    M = X.T @ np.linalg.solve(prestate.V, X)
+    M = info_matrix(X, prestate.plot_sizes, prestate.c)
 
     # Invert information matrix
-    Minv = np.linalg.inv(M)
+    Minv = np_inv_spd(M)
 
-    return DoptimState(prestate.plot_sizes, prestate.alphas, prestate.betas, prestate.betas_inv, prestate.c, prestate.V, Minv)
+    # Preallocate the buffers of the update for the largest level
+    k = 0
+    for level in range(prestate.plot_sizes.size):
+        k = max(k, 2 * update_size(level, prestate.plot_sizes, prestate.betas))
+    U = np.empty((k, X.shape[1]), dtype=Minv.dtype)
+    D = np.empty(k, dtype=Minv.dtype)
+    MinvU = np.empty(X.shape[1] * k, dtype=Minv.dtype)
+    P = np.empty(k * k, dtype=Minv.dtype)
+
+    return DoptimState(prestate.plot_sizes, prestate.alphas, prestate.betas, prestate.betas_inv, prestate.c, prestate.V, Minv, U, D, MinvU, P)
 
 @numba.njit(cache=CACHE)
 def metric(state, Y, X):
@@ -105,9 +113,69 @@ def metric(state, Y, X):
         Return a state object
     """
     # Compute determinant of information matrix
-    metric = np.linalg.det(X.T @ np.linalg.solve(state.V, X))
+    metric = np.linalg.det(info_matrix(X, state.plot_sizes, state.c))
     return metric
 
+@numba.njit(cache=CACHE)
+def __threshold(Minv):
+    """
+    The minimal update factor of the determinant to accept an update.
+    An improvement beyond rounding errors is required, otherwise
+    designs with an equal determinant may be exchanged indefinitely.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    Minv : np.array(2d)
+        The inverse of the information matrix
+
+    Returns
+    -------
+    threshold : float
+        The threshold of the update factor
+    """
+    return 1 + max(1e-10, 1e3 * np.finfo(Minv.dtype).eps)
+
+@numba.njit(cache=CACHE)
+def score(state, X, Xi_star, level, grp):
+    """
+    D-optimal criterion: evaluate an update without applying it. The
+    buffers of the state are not used, the function can therefore be
+    called from multiple threads on the same state.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    state : :py:class:`DoptimState`
+        The state object of the optimizer
+    X : np.array(2d)
+        The model matrix of the current design
+    Xi_star : np.array(2d)
+        The new block of rows
+    level : int
+        The split-level of the update
+    grp : int
+        The group number within the given split-level that was updated
+
+    Returns
+    -------
+    improved : bool
+        Whether the metric would be improved
+    value : float
+        The update factor of the determinant (higher is better)
+    """
+    # Compute U,D from coordinate exchange update
+    U, D = compute_update(level, grp, X, Xi_star, state.plot_sizes, state.c, betas=state.betas)
+
+    # Compute change in determinant
+    du, _, _, _ = det_update(U, D, state.Minv)
+
+    return du > __threshold(state.Minv), du
+
 @numba.njit(cache=CACHE)
 def update(state, X, Xi_star, level, grp):
     """
@@ -137,19 +205,114 @@ def update(state, X, Xi_star, level, grp):
         The new state
     """
     # Compute U,D from coordinate exchange update
-    U, D = compute_update(level, grp, X, Xi_star, state.plot_sizes, state.c, betas=state.betas, betas_inv=state.betas_inv)
+    U, D = compute_update(level, grp, X, Xi_star, state.plot_sizes, state.c, betas=state.betas, U=state.U, D=state.D)
 
     # Compute change in determinant
-    du, P = det_update(U, D, state.Minv)
+    # (singular updates have a zero determinant and are never accepted)
+    du, P, MinvU, piv = det_update(U, D, state.Minv, MinvU=state.MinvU, P=state.P)
 
-    if du > 1:
+    # Require an improvement beyond rounding errors
+    if du > __threshold(state.Minv):
         # Update inv(M)
         Minv = state.Minv
-        Minv -= inv_update(U, D, state.Minv, P=P)
+        Minv -= inv_update(U, D, state.Minv, P, MinvU, piv)
         return True, state
     
     # Return no update
     return False, state
 
+@numba.njit(cache=CACHE)
+def update_batched(state, X, Xi_star, level, grp):
+    """
+    D-optimal criterion: update formula for a batch of candidates of the
+    same group, applying the best candidate. The old rows of U are shared 
+    by all candidates, hence P is split in blocks as
+
+    .. math::
+
+        P = \\begin{bmatrix} P_{oo} & P_{on} \\\\ P_{on}^T & P_{nn} \\end{bmatrix}
+
+    where only :math:`P_{on}` and :math:`P_{nn}` depend on the candidate. The
+    determinant is computed using the Schur complement, 
+    :math:`|P| = |P_{oo}| |P_{nn} - P_{on}^T P_{oo}^{-1} P_{on}|`, requiring
+    only one decomposition of :math:`P_{oo}`.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    state : :py:class:`DoptimState`
+        The state object of the optimizer
+    X : np.array(2d)
+        The model matrix of the current design
+    Xi_star : np.array(3d)
+        The new block of rows of each candidate
+    level : int
+        The split-level of the update
+    grp : int
+        The group number within the given split-level that was updated
+
+    Returns
+    -------
+    best : int
+        The index of the applied candidate, or -1 if no candidate
+        improved the metric
+    state : :py:class:`DoptimState`
+        The new state
+    """
+    # Compute U,D of all candidates (the old part and D are shared)
+    U, D = compute_update(level, grp, X, Xi_star[0], state.plot_sizes, state.c, betas=state.betas, U=state.U, D=state.D)
+    h = U.shape[0] // 2
+    Un = np.empty((Xi_star.shape[0], h, X.shape[1]), dtype=U.dtype)
+    Un[0] = U[h:]
+    for k in range(1, Xi_star.shape[0]):
+        U, D = compute_update(level, grp, X, Xi_star[k], state.plot_sizes, state.c, betas=state.betas, U=state.U, D=state.D)
+        Un[k] = U[h:]
+    Uo = U[:h]
+
+    # The products with the inverse, the new rows of all candidates at once
+    MinvUo = state.Minv @ Uo.T
+    UnMinv = Un.reshape((-1, X.shape[1])) @ state.Minv
+
+    # Decompose the shared block
+    Poo = Uo @ MinvUo
+    for i in range(h):
+        Poo[i, i] += 1/D[i]
+    det_oo, piv = lu_det(Poo)
+    det_oo *= np.prod(D)
+
+    # Compute the change in determinant of each candidate
+    best, best_du = -1, __threshold(state.Minv)
+    for k in range(Xi_star.shape[0]):
+        UnMinv_k = UnMinv[k*h:(k+1)*h]
+        if det_oo == 0:
+            # Singular shared block, evaluate the complete update
+            U[h:] = Un[k]
+            du, _, _, _ = det_update(U, D, state.Minv)
+        else:
+            # Determinant of the Schur complement
+            Pon = Uo @ UnMinv_k.T
+            S = Un[k] @ UnMinv_k.T - Pon.T @ np_lu_solve(Poo, piv, Pon)
+            for i in range(h):
+                S[i, i] += 1/D[h+i]
+            det_s, _ = lu_det(S)
+            du = det_oo * det_s
+        if du > best_du:
+            best, best_du = k, du
+
+    # Apply the best update, validated on the complete update as the
+    # Schur complement is inaccurate for an ill-conditioned shared block
+    if best >= 0:
+        accept, state = update(state, X, Xi_star[best], level, grp)
+        if not accept:
+            best = -1
+
+    return best, state
+
 # Create optimizer
-Doptim = Optim(preinit, init, update, metric)
+Doptim = Optim(preinit, init, update, metric, score)
+
+# Create optimizer evaluating the candidates of a group at once, this is
+# only beneficial for factors with many possible coordinates
+DoptimBatched = Optim(preinit, init, update, metric, score, update_batched)
@@ -1,5 +1,5 @@
-from ..optimizers import compute_update, inv_update_no_P, Optim
-from ..utils import obs_var, CACHE
+from ..optimizers import info_matrix, compute_update, det_update, inv_update, Optim
+from ..utils import obs_var, alphas_betas, np_inv_spd, CACHE
 from ..init import initialize
 from ..encode import encode_design
 from ..doe import x2fx
@@ -7,8 +7,8 @@ from collections import namedtuple
 import numba
 import numpy as np
 
-IoptimPreState = namedtuple('IoptimPreState', 'plot_sizes betas betas_inv c V moments')
-IoptimState = namedtuple('IoptimState', 'plot_sizes betas betas_inv c V moments Minv metric')
+IoptimPreState = namedtuple('IoptimPreState', 'plot_sizes alphas betas betas_inv c V moments')
+IoptimState = namedtuple('IoptimState', 'plot_sizes alphas betas betas_inv c V moments Minv metric')
 
 @numba.njit(cache=CACHE)
 def outer_integral(arr):
@@ -59,8 +59,7 @@ def preinit(plot_sizes, model, factors, ratios):
         The pre state
     """
     # Alphas and betas
-    alphas = np.cumprod(plot_sizes[::-1])[::-1]
-    betas = np.cumprod(np.concatenate((np.array([1]), plot_sizes)))
+    alphas, betas = alphas_betas(plot_sizes)
 
     # Betas inverse
     betas_inv = np.cumsum(np.concatenate((np.array([0], dtype=np.float64), 1/betas[1:])))
@@ -79,7 +78,7 @@ def preinit(plot_sizes, model, factors, ratios):
     samples = x2fx(encode_design(samples, factors), model[1])
     moments = outer_integral(samples)
 
-    return IoptimPreState(plot_sizes, betas, betas_inv, c, V, moments)
+    return IoptimPreState(plot_sizes, alphas, betas, betas_inv, c, V, moments)
 
 @numba.njit(cache=CACHE)
 def init(prestate, Y, X): 
@@ -108,15 +107,15 @@ def init(prestate, Y, X):
         raise np.linalg.LinAlgError('Matrix M is singular')
 
     # Compute information matrix
-    M = X.T @ np.linalg.solve(prestate.V, X)
+    M = info_matrix(X, prestate.plot_sizes, prestate.c)
 
     # Invert information matrix
-    Minv = np.linalg.inv(M)
+    Minv = np_inv_spd(M)
 
     # Compute the initial metric
     metric = np.array([__metric(prestate.moments, Minv)])
 
-    return IoptimState(prestate.plot_sizes, prestate.betas, prestate.betas_inv, prestate.c, prestate.V, prestate.moments, Minv, metric)
+    return IoptimState(prestate.plot_sizes, prestate.alphas, prestate.betas, prestate.betas_inv, prestate.c, prestate.V, prestate.moments, Minv, metric)
 
 @numba.njit(cache=CACHE)
 def __metric(moments, Minv):
@@ -199,10 +198,15 @@ def update(state, X, Xi_star, level, grp):
         The new state
     """
     # Compute U,D from coordinate exchange update
-    U, D = compute_update(level, grp, X, Xi_star, state.plot_sizes, state.c, betas=state.betas, betas_inv=state.betas_inv)
+    U, D = compute_update(level, grp, X, Xi_star, state.plot_sizes, state.c, betas=state.betas)
+
+    # Compute P and validate that the update is not singular
+    du, P, MinvU, piv = det_update(U, D, state.Minv)
+    if du == 0:
+        return False, state
 
     # Compute change in inverse
-    Minv_u = inv_update_no_P(U, D, state.Minv)
+    Minv_u = inv_update(U, D, state.Minv, P, MinvU, piv)
 
     # Compute update to the metric (!minus sign!)
     i_update = -np.sum(Minv_u * state.moments.T)
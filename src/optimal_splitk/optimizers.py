@@ -1,12 +1,174 @@
 from collections import namedtuple
 import numba
 import numpy as np
-from .utils import CACHE
+from .utils import np_lu, np_lu_solve, np_inv_spd, CACHE
 
-Optim = namedtuple('Optim', 'preinit init update metric')
+# The score function is optional; it evaluates an update without
+# applying it and enables the parallel evaluation of the groups.
+# The batched update is optional; it evaluates all candidate
+# coordinates of a group at once and applies the best.
+Optim = namedtuple('Optim', 'preinit init update metric score update_batched', defaults=(None, None))
 
 @numba.njit(cache=CACHE)
-def compute_update(level, grp, X, Xi_star, plot_sizes, c, betas=None, betas_inv=None):
+def info_matrix(X, plot_sizes, c):
+    """
+    Compute the information matrix :math:`M = X^T V^{-1} X` without
+    solving against the observation variance matrix. The inverse
+    has the closed form :math:`V^{-1} = \\sum_i c_i Z_i Z_i^T`, hence
+    :math:`M = \\sum_i c_i (Z_i^T X)^T (Z_i^T X)`, where :math:`Z_i^T X`
+    are the sums of the rows of X per group at level i.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    X : np.array(2d)
+        The model matrix of the design
+    plot_sizes : np.array(1d)
+        The plot sizes of the generalized split-plot
+    c : np.array(1d)
+        The c-coefficients of the inverse observation variance matrix
+
+    Returns
+    -------
+    M : np.array(2d)
+        The information matrix
+    """
+    # Level-0 contribution
+    M = c[0] * (X.T @ X)
+
+    # Sum the groups of each level
+    Xs = np.ascontiguousarray(X)
+    for i in range(1, plot_sizes.size):
+        Xs = np.sum(Xs.reshape((-1, plot_sizes[i-1], Xs.shape[1])), axis=1)
+        M += c[i] * (Xs.T @ Xs)
+
+    return M
+
+@numba.njit(cache=CACHE)
+def info_matvec(X, plot_sizes, c, z):
+    """
+    Compute the product of the information matrix with a vector,
+    :math:`M z = \\sum_i c_i X^T Z_i Z_i^T X z`, without computing
+    the information matrix (see :py:func:`info_matrix`).
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    X : np.array(2d)
+        The model matrix of the design
+    plot_sizes : np.array(1d)
+        The plot sizes of the generalized split-plot
+    c : np.array(1d)
+        The c-coefficients of the inverse observation variance matrix
+    z : np.array(1d)
+        The vector
+
+    Returns
+    -------
+    Mz : np.array(1d)
+        The product of the information matrix with the vector
+    """
+    # Level-0 contribution
+    Xz = X @ z
+    w = c[0] * Xz
+
+    # Sum the groups of each level and repeat the sums for each run
+    s = Xz
+    size = 1
+    for i in range(1, plot_sizes.size):
+        size *= plot_sizes[i-1]
+        s = np.sum(s.reshape((-1, plot_sizes[i-1])), axis=1)
+        w += c[i] * np.repeat(s, size)
+
+    return X.T @ w
+
+@numba.njit(cache=CACHE)
+def refresh_inverse(X, state, n_updates, n_stale, refresh_every=5, tol=None):
+    """
+    Recompute the inverse of the information matrix in the state, to
+    remove the numerical drift of the incremental updates. The inverse is
+    only recomputed if many updates were applied (more than a quarter of the
+    amount of terms), if it was not recomputed for several iterations, or
+    otherwise if the drift, estimated as :math:`||z - M^{-1} M z|| / ||z||`
+    for a random vector z, exceeds the tolerance.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    X : np.array(2d)
+        The model matrix of the design
+    state : `State`
+        The state of the optimizer, it must contain the plot sizes,
+        the c-coefficients and the inverse of the information matrix
+    n_updates : int
+        The amount of updates since the last recomputation
+    n_stale : int
+        The amount of iterations since the last recomputation
+    refresh_every : int
+        The maximum amount of iterations without recomputation
+    tol : float
+        The maximal relative drift, or None for :math:`\\max(10^{-6}, 10^3 \\epsilon)`
+        with :math:`\\epsilon` the machine epsilon of the inverse (a freshly
+        computed inverse already has a drift of the order of epsilon).
+
+    Returns
+    -------
+    refreshed : bool
+        Whether the inverse was recomputed
+    """
+    if tol is None:
+        tol = max(1e-6, 1e3 * np.finfo(state.Minv.dtype).eps)
+
+    if n_updates <= max(1, X.shape[1] // 4) and n_stale < refresh_every:
+        # Estimate the drift
+        z = np.random.standard_normal(X.shape[1]).astype(state.Minv.dtype)
+        r = z - state.Minv @ info_matvec(X, state.plot_sizes, state.c, z)
+        if np.linalg.norm(r) <= tol * np.linalg.norm(z):
+            return False
+
+    # Recompute the inverse
+    state.Minv[:] = np_inv_spd(info_matrix(X, state.plot_sizes, state.c))
+    return True
+
+@numba.njit(cache=CACHE)
+def update_size(level, plot_sizes, betas):
+    """
+    Compute the amount of rows of the old (or new) part of the U
+    matrix when updating a group at the given level, i.e., the runs
+    of the group, their sums at each level up to the given level
+    and the sums of the groups containing it at each higher level.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    level : int
+        The level at which to make the adjustment
+    plot_sizes : np.array(1d)
+        The plot sizes of the generalized split-plot
+    betas : np.array(1d)
+        The beta values
+
+    Returns
+    -------
+    size : int
+        The amount of rows, half of the rows of U
+    """
+    jmp = betas[level]
+    size = jmp + (plot_sizes.size - level - 1)
+    for i in range(1, level + 1):
+        size += jmp // betas[i]
+    return size
+
+@numba.njit(cache=CACHE)
+def compute_update(level, grp, X, Xi_star, plot_sizes, c, betas=None, betas_inv=None, U=None, D=None):
     """
     Compute the update to the information matrix after making
     a single coordinate adjustment. This update is expressed
@@ -33,7 +195,12 @@ def compute_update(level, grp, X, Xi_star, plot_sizes, c, betas=None, betas_inv=
     betas : np.array(1d)
         The beta values, precomputed, or None
     betas_inv : np.array(1d)
-        The inverse beta values, precomputed, or None
+        Not used, for compatibility purposes
+    U : np.array(2d)
+        A buffer for the U matrix, possible to use preallocation. It
+        requires at least as many rows as the returned matrix.
+    D : np.array(1d)
+        A buffer for the D matrix, possible to use preallocation
 
     Returns
     -------
@@ -46,8 +213,6 @@ def compute_update(level, grp, X, Xi_star, plot_sizes, c, betas=None, betas_inv=
     # Extract state
     if betas is None:
         betas = np.cumprod(np.concatenate((np.array([1]), plot_sizes)))
-    if betas_inv is None:
-        betas_inv = np.cumsum(np.concatenate((np.array([0], dtype=np.float64), 1/betas[1:])))
 
     # First runs
     jmp = betas[level]
@@ -57,15 +222,21 @@ def compute_update(level, grp, X, Xi_star, plot_sizes, c, betas=None, betas_inv=
     Xi = X[runs]
 
     # Initialize U and D
-    star_offset = int(Xi.shape[0] * (1 + betas_inv[level])) + (plot_sizes.size - level - 1)
-    U = np.zeros((2*star_offset, Xi.shape[1]))
-    D = np.zeros(2*star_offset)
+    star_offset = update_size(level, plot_sizes, betas)
+    if U is None:
+        U = np.zeros((2*star_offset, Xi.shape[1]), dtype=X.dtype)
+    else:
+        U = U[:2*star_offset]
+    if D is None:
+        D = np.zeros(2*star_offset, dtype=X.dtype)
+    else:
+        D = D[:2*star_offset]
 
     # Store level-0 results
     U[:Xi.shape[0]] = Xi
     U[star_offset: star_offset + Xi.shape[0]] = Xi_star
-    D[:Xi.shape[0]] = -np.ones(Xi.shape[0])
-    D[star_offset: star_offset + Xi.shape[0]] = np.ones(Xi.shape[0])
+    D[:Xi.shape[0]] = -1
+    D[star_offset: star_offset + Xi.shape[0]] = 1
     co = Xi.shape[0]
 
     # Loop before (= summations)
@@ -130,7 +301,44 @@ def compute_update(level, grp, X, Xi_star, plot_sizes, c, betas=None, betas_inv=
     return U, D
 
 @numba.njit(cache=CACHE)
-def det_update(U, D, Minv):
+def lu_det(A):
+    """
+    Compute the determinant of a matrix from its in-place LU decomposition
+    (see :py:func:`optimal_splitk.utils.np_lu`). If the smallest pivot is 
+    below :math:`\\max(10^{-12}, 10^3 \\epsilon)` times the largest pivot, with
+    :math:`\\epsilon` the machine epsilon of A, the matrix is considered
+    singular and the determinant is zero.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    A : np.array(2d)
+        The square matrix, overwritten by its LU decomposition
+
+    Returns
+    -------
+    det : float
+        The determinant, or zero if the matrix is singular
+    piv : np.array(1d)
+        The pivots of the LU decomposition
+    """
+    # Decompose A
+    piv, sign = np_lu(A)
+
+    # Validate the smallest pivot
+    pmin, pmax = np.inf, 0.0
+    for i in range(A.shape[0]):
+        pmin = min(pmin, abs(A[i, i]))
+        pmax = max(pmax, abs(A[i, i]))
+    if pmin < max(1e-12, 1e3 * np.finfo(A.dtype).eps) * pmax:
+        return 0.0, piv
+
+    return sign * np.prod(np.diag(A)), piv
+
+@numba.njit(cache=CACHE)
+def det_update(U, D, Minv, MinvU=None, P=None):
     """
     Compute the determinant adjustment as a factor.
     In other words: :math:`|M^*|=\\alpha*|M|`. The new
@@ -143,6 +351,10 @@ def det_update(U, D, Minv):
 
         \\alpha = |D| |P| = |D| |D^{-1} + U M^{-1} U.T|
 
+    The determinant is computed from the LU decomposition of P
+    (see :py:func:`lu_det`), which is reused to solve against P 
+    in :py:func:`inv_update`. If P is singular, alpha is zero.
+
     .. note::
         This function is Numba accelerated
 
@@ -155,24 +367,44 @@ def det_update(U, D, Minv):
         inserted as a 1d array representing the diagonal.
     Minv : np.array(2d)
         The current inverse of the information matrix.
+    MinvU : np.array(1d)
+        A flat buffer for the product :math:`M^{-1} U^T`, possible
+        to use preallocation
+    P : np.array(1d)
+        A flat buffer for the P matrix, possible to use preallocation
 
     Returns
     -------
     alpha : float
-        The update factor
+        The update factor, or zero if the update is singular
     P : np.array(2d)
-        The P matrix of the update
+        The LU decomposition of the P matrix of the update
+    MinvU : np.array(2d)
+        The product :math:`M^{-1} U^T`, which can be reused
+        in :py:func:`inv_update`
+    piv : np.array(1d)
+        The pivots of the LU decomposition of P
     """
     # Compute P
-    P = U @ Minv @ U.T
+    if MinvU is None:
+        MinvU = Minv @ U.T
+    else:
+        MinvU = MinvU[:Minv.shape[0]*U.shape[0]].reshape((Minv.shape[0], U.shape[0]))
+        np.dot(Minv, U.T, MinvU)
+    if P is None:
+        P = U @ MinvU
+    else:
+        P = P[:U.shape[0]*U.shape[0]].reshape((U.shape[0], U.shape[0]))
+        np.dot(U, MinvU, P)
     for i in range(P.shape[0]):
         P[i, i] += 1/D[i]
 
     # Compute determinant update
-    return np.linalg.det(P) * np.prod(D), P
+    det, piv = lu_det(P)
+    return det * np.prod(D), P, MinvU, piv
 
 @numba.njit(cache=CACHE)
-def inv_update(U, D, Minv, P):
+def inv_update(U, D, Minv, P, MinvU=None, piv=None):
     """
     Compute the update of the inverse of the information matrix.
     In other words: :math:`M^{*-1} = M^{-1} - M_{up}`. The new
@@ -201,14 +433,25 @@ def inv_update(U, D, Minv, P):
     Minv : np.array(2d)
         The current inverse of the information matrix.
     P : np.array(1d)
-        The P matrix if already pre-computed.
+        The P matrix if already pre-computed, or its LU decomposition
+        if the pivots are provided.
+    MinvU : np.array(2d)
+        The product :math:`M^{-1} U^T` if already pre-computed, or None.
+        As the inverse is symmetric, :math:`U M^{-1}` is its transpose.
+    piv : np.array(1d)
+        The pivots of the LU decomposition of P as returned by
+        :py:func:`det_update`, or None.
 
     Returns
     -------
     Mup : np.array(2d)
         The update to the inverse matrix.
     """
-    return (Minv @ U.T) @ np.linalg.solve(P, U @ Minv)
+    if MinvU is None:
+        MinvU = Minv @ U.T
+    if piv is None:
+        return MinvU @ np.linalg.solve(P, np.ascontiguousarray(MinvU.T))
+    return MinvU @ np_lu_solve(P, piv, MinvU.T)
 
 @numba.njit(cache=CACHE)
 def inv_update_no_P(U, D, Minv):
@@ -219,8 +462,8 @@ def inv_update_no_P(U, D, Minv):
     .. note::
         This function is Numba accelerated
     """
-    P = U @ Minv @ U.T
+    MinvU = Minv @ U.T
+    P = U @ MinvU
     for i in range(P.shape[0]):
         P[i, i] += 1/D[i]
-    return inv_update(U, D, Minv, P)
-
+    return inv_update(U, D, Minv, P, MinvU)
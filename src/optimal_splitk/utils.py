@@ -1,8 +1,16 @@
+import os
+import pickle
+import shutil
+import hashlib
+import inspect
+import functools
 import numba
 import numpy as np
 from numba.typed import List
+from . import __version__
 
 CACHE = False
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'optimal_splitk')
 
 ##################################################################
 ##  NUMBA COMPATIBLE NUMPY FUNCTIONS
@@ -78,10 +86,201 @@ def np_argmax1(arr):
         out[i] = np.argmax(arr[i])
     return out
 
+@numba.njit(cache=CACHE)
+def np_seed(seed):
+    """
+    Seed the random number generator used inside Numba compiled
+    functions. This generator is independent of NumPy's and has a
+    separate state for each thread.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    seed : int
+        The seed
+    """
+    np.random.seed(seed)
+
+@numba.njit(cache=CACHE)
+def np_inv_spd(M):
+    """
+    Inverse of a symmetric positive definite matrix using its
+    Cholesky decomposition :math:`M = L L^T`, as
+    :math:`M^{-1} = L^{-T} L^{-1}`.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    M : np.array(2d)
+        The symmetric positive definite matrix
+
+    Returns
+    -------
+    Minv : np.array(2d)
+        The inverse of M
+
+    Raises
+    ------
+    np.linalg.LinAlgError
+        If the matrix is not positive definite
+    """
+    # Cholesky decomposition
+    L = np.linalg.cholesky(M)
+
+    # Invert the lower triangular matrix (forward substitution)
+    n = L.shape[0]
+    Linv = np.zeros_like(L)
+    for i in range(n):
+        Linv[i, i] = 1 / L[i, i]
+        for j in range(i):
+            s = 0.0
+            for k in range(j, i):
+                s += L[i, k] * Linv[k, j]
+            Linv[i, j] = -s / L[i, i]
+
+    return Linv.T @ Linv
+
+@numba.njit(cache=CACHE)
+def np_lu(A):
+    """
+    In-place LU decomposition with partial pivoting, :math:`A[piv] = L U`.
+    After the decomposition, the strict lower triangle of A contains
+    L (with a unit diagonal) and the upper triangle contains U. The
+    determinant of A is the sign times the product of the diagonal.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    A : np.array(2d)
+        The square matrix to decompose, overwritten by the decomposition
+
+    Returns
+    -------
+    piv : np.array(1d)
+        The row of A corresponding to each row of the decomposition
+    sign : float
+        The sign of the permutation
+    """
+    n = A.shape[0]
+    piv = np.arange(n)
+    sign = 1.0
+    for j in range(n):
+        # Find the pivot
+        p = j
+        for i in range(j+1, n):
+            if abs(A[i, j]) > abs(A[p, j]):
+                p = i
+
+        # Swap the rows
+        if p != j:
+            for k in range(n):
+                A[j, k], A[p, k] = A[p, k], A[j, k]
+            piv[j], piv[p] = piv[p], piv[j]
+            sign = -sign
+
+        # Eliminate the column
+        if A[j, j] != 0:
+            for i in range(j+1, n):
+                A[i, j] /= A[j, j]
+                for k in range(j+1, n):
+                    A[i, k] -= A[i, j] * A[j, k]
+
+    return piv, sign
+
+@numba.njit(cache=CACHE)
+def np_lu_solve(LU, piv, B):
+    """
+    Solve :math:`A X = B` using the LU decomposition of A as returned
+    by :py:func:`np_lu`.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    LU : np.array(2d)
+        The LU decomposition of A
+    piv : np.array(1d)
+        The pivots of the decomposition
+    B : np.array(2d)
+        The right-hand side
+
+    Returns
+    -------
+    X : np.array(2d)
+        The solution
+    """
+    n, m = B.shape
+
+    # Permute the right-hand side
+    X = np.empty_like(B)
+    for i in range(n):
+        X[i] = B[piv[i]]
+
+    # Forward substitution (unit lower triangular)
+    for i in range(n):
+        for k in range(i):
+            for c in range(m):
+                X[i, c] -= LU[i, k] * X[k, c]
+
+    # Backward substitution
+    for i in range(n-1, -1, -1):
+        for k in range(i+1, n):
+            for c in range(m):
+                X[i, c] -= LU[i, k] * X[k, c]
+        for c in range(m):
+            X[i, c] /= LU[i, i]
+
+    return X
+
 ##################################################################
 ##  GENERAL UTILS
 ##################################################################
 
+@numba.njit(cache=CACHE)
+def alphas_betas(plot_sizes):
+    """
+    Compute the amount of groups (alphas) and the amount of runs per
+    group (betas) at each level of the generalized split-plot model.
+    Alpha at level i is the product of the plot sizes from i onwards,
+    beta at level i the product of the plot sizes before i.
+
+    .. note::
+        This function is Numba accelerated
+
+    Parameters
+    ----------
+    plot_sizes : np.array(1d)
+        The array of plot sizes according to the generalized split-plot model.
+
+    Returns
+    -------
+    alphas : np.array(1d)
+        The alpha values, one for each level
+    betas : np.array(1d)
+        The beta values, one for each level and the total amount of runs
+    """
+    n = plot_sizes.size
+    betas = np.empty(n + 1, dtype=np.int64)
+    alphas = np.empty(n, dtype=np.int64)
+
+    # Prefix products
+    betas[0] = 1
+    for i in range(n):
+        betas[i+1] = betas[i] * plot_sizes[i]
+
+    # Suffix products
+    for i in range(n):
+        alphas[i] = betas[n] // betas[i]
+
+    return alphas, betas
+
 @numba.njit(cache=CACHE)
 def obs_var(plot_sizes, alphas=None, betas=None, ratios=None):
     """
@@ -124,3 +323,134 @@ def obs_var(plot_sizes, alphas=None, betas=None, ratios=None):
 
     return V
 
+##################################################################
+##  DISK CACHE
+##################################################################
+
+def __hash_arg(h, arg):
+    """
+    Update the hash with an argument of a cached function. Arrays
+    are hashed by their dtype, shape and content, sequences element-wise
+    and functions (including Numba dispatchers) by their qualified name.
+
+    .. note::
+        See :py:func:`disk_cache` for more information
+
+    """
+    if isinstance(arg, np.ndarray):
+        h.update(f'array({arg.dtype.str},{arg.shape})'.encode())
+        h.update(np.ascontiguousarray(arg).tobytes())
+    elif isinstance(arg, (list, tuple)):
+        h.update(f'{type(arg).__name__}({len(arg)})'.encode())
+        for a in arg:
+            __hash_arg(h, a)
+    elif callable(arg):
+        f = getattr(arg, 'py_func', arg)
+        h.update(f'function({f.__module__}.{f.__qualname__})'.encode())
+    else:
+        h.update(repr(arg).encode())
+
+@functools.lru_cache(maxsize=1)
+def __code_hash():
+    """
+    Hash of the source code of the package, such that modifications
+    of the code invalidate the cached results without a new version.
+
+    .. note::
+        See :py:func:`disk_cache` for more information
+
+    """
+    h = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith('.py'):
+                path = os.path.join(dirpath, name)
+                h.update(os.path.relpath(path, root).encode())
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+def disk_cache(location=CACHE_DIR, ignore=(), required=(), enabled=None):
+    """
+    Decorator to persistently cache the results of a function on disk,
+    keyed by a hash of its arguments (see :py:func:`__hash_arg`), the
+    version of the package and its source code. The cache of the decorated
+    function can be removed by calling its `clear` method. Caching is 
+    best-effort: if the cache cannot be read or written, the function is evaluated.
+
+    Parameters
+    ----------
+    location : str
+        The directory of the cache
+    ignore : list(str)
+        The names of the arguments which do not influence the result
+    required : list(str)
+        The names of the arguments which must not be None for the result
+        to be cached (e.g., the seed of a randomized function)
+    enabled : str
+        The name of a boolean argument of the function disabling the cache
+        when False, or None to always cache. It should also be ignored.
+
+    Returns
+    -------
+    decorator : function
+        The decorator
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        func_dir = os.path.join(location, f'{func.__module__}.{func.__qualname__}')
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Bind the arguments
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+
+            # Only cache deterministic calls, if enabled
+            if any(bound.arguments[name] is None for name in required) \
+                    or (enabled is not None and not bound.arguments[enabled]):
+                return func(*args, **kwargs)
+
+            # Compute the key
+            h = hashlib.sha256(__version__.encode())
+            h.update(__code_hash().encode())
+            for name, arg in bound.arguments.items():
+                if name not in ignore:
+                    h.update(name.encode())
+                    __hash_arg(h, arg)
+            path = os.path.join(func_dir, f'{h.hexdigest()}.pkl')
+
+            # Load the stored result (unreadable results are a cache miss)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'rb') as f:
+                        return pickle.load(f)
+                except Exception:
+                    pass
+
+            # Compute the result
+            result = func(*args, **kwargs)
+
+            # Store the result (best-effort, a failure never loses the result)
+            try:
+                os.makedirs(func_dir, exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    pickle.dump(result, f)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                pass
+
+            return result
+
+        def clear():
+            """
+            Remove all cached results of the function
+            """
+            shutil.rmtree(func_dir, ignore_errors=True)
+
+        wrapper.clear = clear
+        return wrapper
+
+    return decorator
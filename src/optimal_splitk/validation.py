@@ -1,4 +1,5 @@
 import numpy as np
+from .encode import encoded_col_start
 
 
 def validate_model(model, factors, encoded=False):
@@ -25,10 +26,7 @@ def validate_model(model, factors, encoded=False):
     """
     # Start of each column
     if encoded:
-        col_start = np.concatenate((np.array([0]), 
-                                    np.cumsum(np.where(factors[:, 1] > 1, 
-                                                       factors[:, 1] - 1, 
-                                                       np.ones(factors.shape[0], dtype=np.int64)))))
+        col_start = encoded_col_start(factors[:, 1])
     else:
         col_start = np.arange(factors.shape[0] + 1)
 
@@ -78,10 +76,7 @@ def validate_design(Y, model, factors, plot_sizes, encoded=False):
     """
     # Start of each column
     if encoded:
-        col_start = np.concatenate((np.array([0]), 
-                                    np.cumsum(np.where(factors[:, 1] > 1, 
-                                                       factors[:, 1] - 1, 
-                                                       np.ones(factors.shape[0], dtype=np.int64)))))
+        col_start = encoded_col_start(factors[:, 1])
     else:
         col_start = np.arange(factors.shape[0] + 1)
 
@@ -0,0 +1,80 @@
+import numpy as np
+from optimal_splitk.doe import x2fx, x2fx_into, specialize_model_cols, update_model_cols, affected_terms
+
+def test_specialize_model_cols_unused_factor():
+    # The third factor is not part of the model
+    model = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 0], [2, 0, 0]], dtype=np.int64)
+    col_start = np.arange(4)
+    update_cols = specialize_model_cols(model, col_start)
+    terms, offsets = affected_terms(model, col_start)
+
+    Y = np.random.RandomState(0).uniform(-1, 1, (6, 3))
+    for i in range(3):
+        X = np.zeros((6, model.shape[0]))
+        X_ref = np.zeros((6, model.shape[0]))
+        update_cols(X, Y, i)
+        update_model_cols(X_ref, Y, model, terms[offsets[i]:offsets[i+1]])
+        np.testing.assert_array_equal(X, X_ref)
+
+def test_x2fx_float_model():
+    Y = np.array([[1., 2., 3.], [-1., 0.5, 2.]])
+    model = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [1, 1, 1], [0, 3, 2]])
+    X_ref = np.stack([np.prod(Y ** term, axis=1) for term in model], axis=1)
+    np.testing.assert_allclose(x2fx(Y, model), X_ref)
+    np.testing.assert_allclose(x2fx(Y, model.astype(np.float64)), X_ref)
+
+    # Non-integer and negative powers
+    Y = np.array([[4., 2.], [9., 3.]])
+    model = np.array([[0.5, 0], [0, -1]])
+    X_ref = np.array([[2., 0.5], [3., 1/3]])
+    np.testing.assert_allclose(x2fx(Y, model), X_ref)
+    np.testing.assert_allclose(x2fx_into(Y, model, np.empty((2, 2)), np.empty(2)), X_ref)
+
+def test_model_cols_non_integer_powers():
+    model = np.array([[0, 0], [0.5, 0], [0, -1], [1, 2], [5, 0]], dtype=np.float64)
+    col_start = np.arange(3)
+    update_cols = specialize_model_cols(model, col_start)
+    terms, offsets = affected_terms(model, col_start)
+
+    Y = np.random.RandomState(0).uniform(0.5, 2, (6, 2))
+    X_ref = x2fx(Y, model)
+    for i in range(2):
+        X = np.zeros((6, model.shape[0]))
+        X_gen = np.zeros((6, model.shape[0]))
+        fterms = terms[offsets[i]:offsets[i+1]]
+        update_model_cols(X, Y, model, fterms)
+        update_cols(X_gen, Y, i)
+        np.testing.assert_allclose(X[:, fterms], X_ref[:, fterms])
+        np.testing.assert_allclose(X_gen[:, fterms], X_ref[:, fterms])
+
+def __small_doe():
+    factors = np.array([[1, 1], [0, 1], [0, 3]], dtype=np.int64)
+    plot_sizes = np.array([4, 3], dtype=np.int64)
+    model = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [0, 2, 0]], dtype=np.int64)
+    return model, plot_sizes, factors
+
+def __doe_metric(Y, model, plot_sizes, factors):
+    from optimal_splitk.encode import encode_model, encode_design
+    from optimal_splitk.utils import obs_var
+    X = x2fx(encode_design(Y, factors), encode_model(model, factors))
+    return np.linalg.det(X.T @ np.linalg.solve(obs_var(plot_sizes), X))
+
+def test_doe_n_jobs():
+    from optimal_splitk.doe import doe
+    model, plot_sizes, factors = __small_doe()
+    Y1, metrics1 = doe(model, plot_sizes, factors, n_tries=4, max_it=50, seed=42, n_jobs=1, cache=False)
+    Y2, metrics2 = doe(model, plot_sizes, factors, n_tries=4, max_it=50, seed=42, n_jobs=2, cache=False)
+    np.testing.assert_array_equal(Y1, Y2)
+    np.testing.assert_array_equal(metrics1, metrics2)
+
+def test_doe_parallel():
+    import numba
+    from optimal_splitk.doe import doe
+    model, plot_sizes, factors = __small_doe()
+    num_threads = numba.get_num_threads()
+    Y, metrics = doe(model, plot_sizes, factors, n_tries=2, max_it=50, seed=0, 
+                     parallel=True, n_jobs=2, cache=False)
+    assert numba.get_num_threads() == num_threads
+    assert Y.shape == (np.prod(plot_sizes), factors.shape[0])
+    np.testing.assert_allclose(np.max(metrics), __doe_metric(Y, model, plot_sizes, factors), rtol=1e-8)
+    assert np.max(metrics) > 0
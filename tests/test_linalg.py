@@ -0,0 +1,157 @@
+import numpy as np
+from optimal_splitk.utils import np_lu, np_lu_solve, np_inv_spd, obs_var
+from optimal_splitk.optimizers import info_matrix, info_matvec, lu_det
+
+def test_np_lu():
+    # A zero leading element requires pivoting
+    A = np.array([[0., 2., 1.], [1., 1., 0.], [3., 0., 1.]])
+    LU = A.copy()
+    piv, sign = np_lu(LU)
+    L = np.tril(LU, -1) + np.eye(3)
+    U = np.triu(LU)
+    np.testing.assert_allclose(L @ U, A[piv])
+    np.testing.assert_allclose(sign * np.prod(np.diag(U)), np.linalg.det(A))
+
+def test_np_lu_solve():
+    rng = np.random.RandomState(0)
+    A = rng.standard_normal((6, 6))
+    A[0, 0] = 0
+    B = rng.standard_normal((6, 3))
+    LU = A.copy()
+    piv, _ = np_lu(LU)
+    np.testing.assert_allclose(np_lu_solve(LU, piv, B), np.linalg.solve(A, B))
+
+def test_lu_det():
+    rng = np.random.RandomState(1)
+    A = rng.standard_normal((5, 5))
+    det, _ = lu_det(A.copy())
+    np.testing.assert_allclose(det, np.linalg.det(A))
+
+    # Singular matrix (linearly dependent rows)
+    A[4] = A[0] + 2 * A[1]
+    det, _ = lu_det(A.copy())
+    assert det == 0
+    det, _ = lu_det(A.astype(np.float32))
+    assert det == 0
+
+def test_np_inv_spd():
+    rng = np.random.RandomState(2)
+    A = rng.standard_normal((8, 5))
+    M = A.T @ A
+    np.testing.assert_allclose(np_inv_spd(M), np.linalg.inv(M), rtol=1e-10)
+
+def test_info_matrix():
+    rng = np.random.RandomState(3)
+    plot_sizes = np.array([2, 3, 2])
+    ratios = np.array([1., 2., 0.5])
+    X = rng.standard_normal((np.prod(plot_sizes), 4))
+
+    # c-coefficients of the closed form inverse of V
+    betas = np.cumprod(np.concatenate(([1], plot_sizes)))
+    c = np.zeros(plot_sizes.size)
+    c[0] = 1
+    for i in range(1, c.size):
+        c[i] = -ratios[i] * np.sum(betas[:i] * c[:i]) / np.sum(ratios[:i+1] * betas[:i+1])
+
+    V = obs_var(plot_sizes, ratios=ratios)
+    M = X.T @ np.linalg.solve(V, X)
+    np.testing.assert_allclose(info_matrix(X, plot_sizes, c), M)
+
+    z = rng.standard_normal(4)
+    np.testing.assert_allclose(info_matvec(X, plot_sizes, c, z), M @ z)
+
+def test_refresh_inverse_float32():
+    from collections import namedtuple
+    from optimal_splitk.optimizers import refresh_inverse
+    State = namedtuple('State', 'plot_sizes c Minv')
+
+    rng = np.random.RandomState(4)
+    plot_sizes = np.array([4, 10])
+    c = np.array([1., -0.2])
+    for dtype in (np.float64, np.float32):
+        X = rng.standard_normal((40, 30)).astype(dtype)
+        state = State(plot_sizes, c.astype(dtype), np_inv_spd(info_matrix(X, plot_sizes, c.astype(dtype))))
+
+        # A freshly computed inverse has no drift beyond the tolerance
+        assert not refresh_inverse(X, state, 1, 0)
+
+        # Large numbers of updates always refresh
+        assert refresh_inverse(X, state, 30, 0)
+
+def __batched_state(plot_sizes, X):
+    from optimal_splitk.optim.doptim import preinit, init
+    prestate = preinit(plot_sizes, None, None, np.array([1., 2.]))
+    return init(prestate, None, X)
+
+def __det_updates(state, X, Xi_star, level, grp):
+    from optimal_splitk.optimizers import compute_update, det_update
+    dus = []
+    for Xk in Xi_star:
+        U, D = compute_update(level, grp, X, Xk, state.plot_sizes, state.c, betas=state.betas)
+        dus.append(det_update(U, D, state.Minv)[0])
+    return np.array(dus)
+
+def test_update_batched():
+    from optimal_splitk.optim.doptim import update_batched
+    rng = np.random.RandomState(5)
+    plot_sizes = np.array([3, 4])
+    level, grp = 1, 2
+    X = rng.standard_normal((12, 4))
+    state = __batched_state(plot_sizes, X)
+
+    # The best candidate is applied
+    Xi_star = rng.standard_normal((5, 3, 4))
+    dus = __det_updates(state, X, Xi_star, level, grp)
+    best, state = update_batched(state, X, Xi_star, level, grp)
+    assert dus.max() > 1 and best == np.argmax(dus)
+    X[grp*3:(grp+1)*3] = Xi_star[best]
+    np.testing.assert_allclose(state.Minv, np.linalg.inv(info_matrix(X, plot_sizes, state.c)), atol=1e-10)
+
+    # No candidate improves the current rows
+    Minv = state.Minv.copy()
+    Xi_star = np.repeat(X[None, grp*3:(grp+1)*3], 3, axis=0)
+    best, state = update_batched(state, X, Xi_star, level, grp)
+    assert best == -1
+    np.testing.assert_array_equal(state.Minv, Minv)
+
+def test_update_batched_singular_shared_block():
+    from optimal_splitk.optim.doptim import update_batched
+    from optimal_splitk.optimizers import compute_update
+    rng = np.random.RandomState(6)
+    plot_sizes = np.array([2, 3])
+    level, grp = 0, 1
+
+    # In a saturated design, removing a run leaves a singular
+    # information matrix, hence a singular shared block
+    X = rng.standard_normal((6, 6))
+    state = __batched_state(plot_sizes, X)
+    U, D = compute_update(level, grp, X, X[grp:grp+1], plot_sizes, state.c, betas=state.betas)
+    h = U.shape[0] // 2
+    Poo = U[:h] @ state.Minv @ U[:h].T + np.diag(1 / D[:h])
+    assert lu_det(Poo)[0] == 0
+
+    Xi_star = rng.standard_normal((4, 1, 6))
+    dus = __det_updates(state, X, Xi_star, level, grp)
+    best, state = update_batched(state, X, Xi_star, level, grp)
+    assert dus.max() > 1 and best == np.argmax(dus)
+    X[grp] = Xi_star[best]
+    np.testing.assert_allclose(state.Minv, np.linalg.inv(info_matrix(X, plot_sizes, state.c)), rtol=1e-6)
+
+def test_update_size():
+    from optimal_splitk.optimizers import update_size, compute_update
+    plot_sizes = np.array([7, 9, 2])
+    betas = np.cumprod(np.concatenate(([1], plot_sizes)))
+    assert update_size(2, plot_sizes, betas) == 73
+
+    # All rows of the buffers are written for each level
+    rng = np.random.RandomState(7)
+    X = rng.standard_normal((np.prod(plot_sizes), 3))
+    c = np.array([1., -0.1, -0.05])
+    for level in range(plot_sizes.size):
+        jmp = betas[level]
+        Ubuf = np.full((2 * update_size(level, plot_sizes, betas), 3), np.nan)
+        Dbuf = np.full(Ubuf.shape[0], np.nan)
+        Xi_star = rng.standard_normal((jmp, 3))
+        U, D = compute_update(level, 0, X, Xi_star, plot_sizes, c, betas=betas, U=Ubuf, D=Dbuf)
+        assert U.shape[0] == D.size == Ubuf.shape[0]
+        assert np.all(np.isfinite(U)) and np.all(np.isfinite(D))
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+from optimal_splitk.utils import disk_cache
+
+def test_disk_cache_unwritable(tmp_path):
+    # The cache directory cannot be created below a file
+    location = tmp_path / 'file'
+    location.write_text('')
+
+    @disk_cache(location=str(location), required=('seed',))
+    def f(x, seed=None):
+        return x + 1
+
+    assert f(1, seed=0) == 2
+
+def test_disk_cache_corrupt(tmp_path):
+    calls = []
+
+    @disk_cache(location=str(tmp_path), required=('seed',))
+    def f(x, seed=None):
+        calls.append(x)
+        return np.array([x])
+
+    assert f(1, seed=0)[0] == 1
+    assert f(1, seed=0)[0] == 1
+    assert len(calls) == 1
+
+    # Corrupt the stored result
+    for root, _, files in os.walk(tmp_path):
+        for name in files:
+            with open(os.path.join(root, name), 'wb') as fp:
+                fp.write(b'corrupt')
+
+    assert f(1, seed=0)[0] == 1
+    assert len(calls) == 2
+
+def test_disk_cache_disabled(tmp_path):
+    calls = []
+
+    @disk_cache(location=str(tmp_path), ignore=('cache',), required=('seed',), enabled='cache')
+    def f(x, seed=None, cache=True):
+        calls.append(x)
+        return x + 1
+
+    assert f(1, seed=0, cache=False) == 2
+    assert f(1, seed=0, cache=False) == 2
+    assert len(calls) == 2
+    assert not os.listdir(tmp_path)
+
+    # Enabling the cache is not part of the key
+    assert f(1, seed=0) == 2
+    assert f(1, seed=0) == 2
+    assert len(calls) == 3